@@ -0,0 +1,148 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Module to parse directory listings on a remote FTP server."""
+
+from html.parser import HTMLParser
+import re
+import requests
+
+# Number of bytes of the listing parsed at a time
+CHUNK_SIZE = 16 * 1024
+
+
+class DirectoryParser(HTMLParser):
+    """Class to parse directory listings"""
+
+    def __init__(self, url, authentication=None, timeout=None, session=None,
+                 etag=None, last_modified=None, stream=False, parser='html'):
+        self.authentication = authentication
+        self.timeout = timeout
+        # Validators of a previously fetched listing. If the server answers
+        # 304 Not Modified, entries stay empty and not_modified is set so
+        # the caller can reuse its cached entries.
+        self.etag = etag
+        self.last_modified = last_modified
+        self.not_modified = False
+        # Fall back to module-level requests when no shared session is given
+        self.session = session or requests
+
+        self.active_url = None
+        self.active_text = None
+        self.entries = []
+        self.response = None
+
+        HTMLParser.__init__(self)
+
+        # lxml parses in C and only reports the finished links
+        self._pull_parser = None
+        if parser == 'lxml':
+            from lxml import etree
+            self._pull_parser = etree.HTMLPullParser(events=('end',), tag='a')
+
+        # Force the server to not send cached content
+        headers = {'Cache-Control': 'max-age=0'}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        r = self.session.get(url, auth=self.authentication,
+                             headers=headers, timeout=self.timeout,
+                             stream=True)
+
+        try:
+            r.raise_for_status()
+        except:
+            r.close()
+            raise
+
+        if r.status_code == 304:
+            self.not_modified = True
+            r.close()
+            return
+
+        self.etag = r.headers.get('ETag')
+        self.last_modified = r.headers.get('Last-Modified')
+        self.response = r
+
+        # Unless the caller wants to consume the listing while it arrives,
+        # parse all of it right away
+        if not stream:
+            for batch in self.iter_batches():
+                pass
+
+    def iter_batches(self):
+        """Parse the listing as it arrives, yielding each batch of new entries"""
+
+        r = self.response
+        if r is None:
+            return
+        self.response = None
+
+        if r.encoding is None:
+            r.encoding = 'utf-8'
+        feed, close = self.feed, self.close
+        if self._pull_parser is not None:
+            feed, close = self._feed_lxml, self._close_lxml
+        try:
+            start = 0
+            for chunk in r.iter_content(chunk_size=CHUNK_SIZE, decode_unicode=True):
+                feed(chunk)
+                if len(self.entries) > start:
+                    yield self.entries[start:]
+                    start = len(self.entries)
+            close()
+            if len(self.entries) > start:
+                yield self.entries[start:]
+        finally:
+            r.close()
+
+    def _feed_lxml(self, data):
+        self._pull_parser.feed(data)
+        self._read_lxml_events()
+
+    def _close_lxml(self):
+        self._pull_parser.close()
+        self._read_lxml_events()
+
+    def _read_lxml_events(self):
+        for event, element in self._pull_parser.read_events():
+            d = (element.text or '').strip()
+            if d != '':
+                self.entries.append(d)
+
+    def filter(self, filter):
+        """Filter entries by calling function or applying regex."""
+
+        if hasattr(filter, '__call__'):
+            return [entry for entry in self.entries if filter(entry)]
+        else:
+            pattern = re.compile(filter, re.IGNORECASE)
+            return [entry for entry in self.entries if pattern.match(entry)]
+
+    def handle_starttag(self, tag, attrs):
+        if not tag == 'a':
+            return
+
+        # The text of a link may arrive in several feed() calls, so it is
+        # only added to the entries once the link is closed
+        self.active_text = []
+        for attr in attrs:
+            if attr[0] == 'href':
+                self.active_url = attr[1]
+                return
+
+    def handle_endtag(self, tag):
+        if not tag == 'a' or self.active_text is None:
+            return
+
+        d = ''.join(self.active_text).strip()
+        self.active_url = None
+        self.active_text = None
+        if d != '':
+            self.entries.append(d)
+
+    def handle_data(self, data):
+        if self.active_text is not None:
+            self.active_text.append(data)
@@ -4,11 +4,18 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import asyncio
+import errno
+import mmap
 import os
-import urllib
+import random
+import select
+import sqlite3
+import threading
+import time
+from urllib.parse import unquote
 import requests
 import logging
-from datetime import datetime, timedelta
 import progressbar as pb
 
 class TimeoutError(Exception):
@@ -17,90 +24,569 @@ class TimeoutError(Exception):
         self.message = 'The download exceeded the allocated timeout'
         Exception.__init__(self, self.message)
 
-# Chunk size when downloading a file
-CHUNK_SIZE = 16 * 1024
+# Chunk size when downloading a file. Game files are a few hundred KB, so
+# most arrive in one or two reads while each worker thread only holds a
+# 256 KB buffer.
+CHUNK_SIZE = 256 * 1024
+
+# Seconds allowed for establishing a connection to the server
+CONNECT_TIMEOUT = 3.05
+
+# Game files are XML which compresses 5-10x; urllib3 inflates both
+ACCEPT_ENCODING = 'gzip, deflate'
+
+# Seconds between two redraws of a progress bar
+PROGRESS_INTERVAL = 0.1
+
+# Upper bound (in seconds) of the wait between two attempts
+RETRY_DELAY_CAP = 60
+
+def backoff(delay, attempt):
+    """Return the seconds to wait after the given failed attempt (from 0)
+
+    The delay doubles with every attempt, and jitter spreads out the
+    retries of workers which failed at the same time.
+    """
+
+    return min(RETRY_DELAY_CAP, delay * 2 ** attempt) * random.uniform(0.5, 1.5)
+
+def retryable(e):
+    """Tell whether a request which failed with e may succeed when repeated
+
+    Client errors (e.g. 404 for a rained-out game) won't go away, except
+    for request timeouts and rate limiting.
+    """
+
+    response = getattr(e, 'response', None)
+    if response is None:
+        return True
+    return not 400 <= response.status_code < 500 or response.status_code in (408, 429)
+
+class MonitoredWriter(object):
+    """File wrapper counting the bytes written and enforcing a deadline
+
+    The clock is read once per write, and writes arrive in CHUNK_SIZE
+    blocks, so the check costs nothing measurable.
+    """
+
+    def __init__(self, f, deadline=None):
+        self.f = f
+        # An infinite deadline saves write() from testing for None
+        self.deadline = deadline or float('inf')
+        self.bytes_written = 0
+
+    def write(self, data):
+        self.f.write(data)
+        self.advance(len(data))
+
+    def advance(self, n):
+        """Account for n bytes that reached the file"""
+
+        self.bytes_written += n
+        if time.monotonic() >= self.deadline:
+            raise TimeoutError
+
+class RateLimiter(object):
+    """Space requests evenly so at most rate of them start each second
+
+    Shared by all download threads. A rate of 0 disables the limit.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.lock = threading.Lock()
+        self.next = 0.0
+
+    def reserve(self):
+        """Claim the next free slot and return the seconds until it starts"""
+
+        with self.lock:
+            now = time.monotonic()
+            wait = max(0.0, self.next - now)
+            self.next = max(now, self.next) + self.interval
+        return wait
+
+    def acquire(self):
+        """Block until the next request may be sent"""
+
+        # Sleep outside the lock so other threads can claim later slots
+        wait = self.reserve()
+        if wait:
+            time.sleep(wait)
+
+class Manifest(object):
+    """SQLite record of the downloaded files and of files which were missing
+
+    Shared by all download threads, which take turns through a lock. Once
+    closed, lookups find nothing and nothing is recorded.
+    """
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        # With a write-ahead log each per-file commit is a cheap append
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS files ('
+                        'url TEXT PRIMARY KEY, etag TEXT, mtime TEXT, '
+                        'size INTEGER, downloaded_at REAL)')
+        # URLs which answered 404, with the time they last did
+        self.db.execute('CREATE TABLE IF NOT EXISTS missing ('
+                        'url TEXT PRIMARY KEY, checked_at REAL)')
+        self.db.commit()
+
+    def validators(self, url):
+        """Return the ETag and Last-Modified of the file, or Nones"""
+
+        with self.lock:
+            if self.db is None:
+                return None, None
+            row = self.db.execute('SELECT etag, mtime FROM files WHERE url = ?',
+                                  (url,)).fetchone()
+        return row or (None, None)
+
+    def record(self, url, etag, mtime, size):
+        """Remember a file which has just been downloaded"""
+
+        self._execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)',
+                      (url, etag, mtime, size, time.time()))
+
+    def touch(self, url):
+        """Remember that the file was found to be current"""
+
+        self._execute('UPDATE files SET downloaded_at = ? WHERE url = ?',
+                      (time.time(), url))
+
+    def missing_since(self, url):
+        """Return when the file was last found missing, or None"""
+
+        with self.lock:
+            if self.db is None:
+                return None
+            row = self.db.execute('SELECT checked_at FROM missing WHERE url = ?',
+                                  (url,)).fetchone()
+        return row[0] if row else None
+
+    def record_missing(self, url):
+        """Remember that the file answered 404 just now"""
+
+        self._execute('INSERT OR REPLACE INTO missing VALUES (?, ?)',
+                      (url, time.time()))
+
+    def prune_missing(self, before):
+        """Forget the files found missing before the given time"""
+
+        self._execute('DELETE FROM missing WHERE checked_at < ?', (before,))
+
+    def _execute(self, sql, parameters):
+        with self.lock:
+            if self.db is None:
+                return
+            with self.db:
+                self.db.execute(sql, parameters)
+
+    def close(self):
+        with self.lock:
+            if self.db is not None:
+                self.db.close()
+                self.db = None
+
+class ProgressTicker(threading.Thread):
+    """Thread redrawing a progress bar from the byte count of a writer
+
+    Rendering the widgets is far more expensive than copying a chunk, so
+    the bar is repainted on a timer instead of after every write.
+    """
+
+    def __init__(self, pbar, count, interval=PROGRESS_INTERVAL):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.pbar = pbar
+        # Callable returning the number of bytes transferred so far
+        self.count = count
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.pbar.update(self.count())
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.pbar.update(self.count())
+
+# O_DIRECT requires the buffer address, file offset and length of every
+# write to be aligned to the logical block size of the file system
+DIRECT_IO_ALIGNMENT = 4096
+DIRECT_IO_BUFSIZE = 1024 * 1024
+
+class DirectWriter(object):
+    """File-like object writing with O_DIRECT to bypass the page cache
+
+    Data is staged in a page-aligned anonymous mmap and written out in
+    whole blocks. On close the last block is zero padded and the file is
+    truncated back to the number of bytes actually written.
+    """
+
+    def __init__(self, path):
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC |
+                          os.O_DIRECT, 0o644)
+        self.buf = mmap.mmap(-1, DIRECT_IO_BUFSIZE)
+        self.view = memoryview(self.buf)
+        self.pending = 0
+        self.size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, data):
+        offset = 0
+        while offset < len(data):
+            n = min(len(data) - offset, DIRECT_IO_BUFSIZE - self.pending)
+            self.buf[self.pending:self.pending + n] = data[offset:offset + n]
+            self.pending += n
+            self.size += n
+            offset += n
+            if self.pending == DIRECT_IO_BUFSIZE:
+                self._flush(DIRECT_IO_BUFSIZE)
+
+    def _flush(self, length):
+        # Slicing the memoryview hands the aligned mmap memory to write()
+        # without copying it into an unaligned bytes object first
+        os.write(self.fd, self.view[:length])
+        self.pending = 0
+
+    def close(self):
+        if self.fd is None:
+            return
+        try:
+            if self.pending:
+                aligned = -(-self.pending // DIRECT_IO_ALIGNMENT) * DIRECT_IO_ALIGNMENT
+                self.buf[self.pending:aligned] = b'\0' * (aligned - self.pending)
+                self._flush(aligned)
+                os.ftruncate(self.fd, self.size)
+        finally:
+            os.close(self.fd)
+            self.fd = None
+            self.view.release()
+            self.buf.close()
+
+# Bytes moved per splice() call; the default capacity of a Linux pipe
+SPLICE_SIZE = 64 * 1024
+
+def splice_response(r, writer, length):
+    """Move a response body from its socket into the file inside the kernel
+
+    Data goes socket -> pipe -> file with os.splice(), never entering user
+    space. This relies on urllib3 and http.client internals to reach the
+    socket and returns False, having consumed nothing, when they aren't
+    available. The connection is closed afterwards because urllib3 no
+    longer knows where the response ends.
+    """
+
+    if not hasattr(os, 'splice'):
+        return False
+    try:
+        fp = r.raw._fp.fp
+        sock = fp.raw._sock
+    except AttributeError:
+        return False
+
+    # Part of the body may already sit in the buffer behind the headers
+    head = fp.peek()[:length]
+    writer.write(fp.read(len(head)))
+    writer.f.flush()
+    remaining = length - len(head)
+
+    sock_fd = sock.fileno()
+    out_fd = writer.f.fileno()
+    pipe_r, pipe_w = os.pipe()
+    try:
+        while remaining:
+            try:
+                n = os.splice(sock_fd, pipe_w, min(remaining, SPLICE_SIZE))
+            except BlockingIOError:
+                # Sockets with a timeout are non-blocking underneath
+                if not select.select([sock_fd], [], [], sock.gettimeout())[0]:
+                    raise requests.exceptions.ReadTimeout('Read timed out')
+                continue
+            if not n:
+                raise requests.exceptions.ConnectionError(
+                    'Connection closed with %d bytes outstanding' % remaining)
+            remaining -= n
+            while n:
+                moved = os.splice(pipe_r, out_fd, n)
+                n -= moved
+                writer.advance(moved)
+    finally:
+        os.close(pipe_r)
+        os.close(pipe_w)
+        r.close()
+    return True
 
 class GameDayFile(object):
 
-    def __init__(self, directory=None, url=None, file=None, logger=None):
+    # A backfill keeps thousands of games in memory, so they have no __dict__
+    __slots__ = ('url', 'file', 'directory', 'logger', 'session', 'atomic',
+                 'direct_io', 'zero_copy', 'retry_attempts', 'retry_delay',
+                 'rate_limiter', 'manifest')
+
+    def __init__(self, directory=None, url=None, file=None, logger=None,
+                 session=None, atomic=True, direct_io=False, zero_copy=False,
+                 retry_attempts=0, retry_delay=10, rate_limiter=None,
+                 manifest=None):
         self.url = url
         self.file = file
         self.directory = directory
         self.logger = logger
+        self.session = session or requests
+        # Write to a .part file first so an interrupted download never
+        # leaves a truncated file behind under the final name
+        self.atomic = atomic
+        self.direct_io = direct_io
+        self.zero_copy = zero_copy
+        self.retry_attempts = retry_attempts
+        self.retry_delay = retry_delay
+        self.rate_limiter = rate_limiter
+        self.manifest = manifest
 
-    def download(self, dest=None, refresh=False, timeout=None):
-        attempt = 0
+    def _prepare(self, dest):
+        """Return the target and temporary paths of the download"""
 
-        target = os.path.join(dest, self.file)
-
-        # Don't re-download the file unless refreshed
-        if os.path.isfile(target):
-            if refresh:
-                self.logger.info("Redownloading: %s" % self.file)
-            else:
-                self.logger.info("File has already been downloaded: %s" % self.file)
-                return
+        # Skip unquoting the name when nobody will see it
+        if self.logger.isEnabledFor(logging.INFO):
+            self.logger.info('Downloading from: %s', unquote(self.file))
+            self.logger.info('Saving as: %s', self.file)
 
-        self.logger.info('Downloading from: %s' %
-                         (urllib.unquote(self.file)))
-        self.logger.info('Saving as: %s' % self.file)
+        target = os.path.join(dest, self.file)
+        return target, target + ".part" if self.atomic else target
 
-        tmp_file = target + ".part"
+    def download(self, dest=None, timeout=None, progress=True):
+        target, tmp_file = self._prepare(dest)
+        headers = self._conditional_headers(target)
+        headers['Accept-Encoding'] = ACCEPT_ENCODING
 
-        while True:
-            attempt += 1
+        for attempt in range(self.retry_attempts + 1):
             try:
-                start_time = datetime.now()
+                # The socket only limits each read; the deadline bounds the
+                # whole transfer
+                deadline = time.monotonic() + timeout if timeout else None
 
-                # Enable streaming mode so we can download content in chunks
-                r = requests.get(self.url, stream=True)
+                if self.rate_limiter:
+                    self.rate_limiter.acquire()
+
+                # Enable streaming mode so we can download content in chunks.
+                # The read timeout is enforced by the socket on every read.
+                r = self.session.get(self.url, stream=True, headers=headers,
+                                     timeout=(CONNECT_TIMEOUT, timeout))
                 r.raise_for_status()
+                if r.status_code == 304:
+                    r.close()
+                    self._not_modified(target)
+                    return
+
+                # Let urllib3 inflate gzip/deflate bodies while copying
+                r.raw.decode_content = True
+                encoding = r.headers.get('Content-encoding')
 
-                content_length = r.headers.get('Content-length')
-                # ValueError: Value out of range if only total_size given
-                if content_length:
-                    total_size = int(content_length.strip())
-                    max_value = ((total_size / CHUNK_SIZE) + 1) * CHUNK_SIZE
+                out = self._write(r, tmp_file, deadline, progress, encoding)
+
+                if encoding:
+                    self.logger.debug('Received %s with %s: %d bytes for %d',
+                                      self.file, encoding, r.raw.tell(),
+                                      out.bytes_written)
+                break
+            except (requests.exceptions.RequestException, TimeoutError) as e:
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                self.logger.info("Retrying... (attempt %s)", attempt + 2)
 
-                bytes_downloaded = 0
+        if self.atomic:
+            os.replace(tmp_file, target)
+        self._save_validators(target, r.headers)
 
-                log_level = self.logger.getEffectiveLevel()
-                if log_level <= logging.INFO and content_length:
+    def _write(self, r, path, deadline, progress, encoding):
+        """Write the body of response r to path and return the writer used
+
+        The file is removed when writing fails for any reason, so a
+        truncated file is never taken for a finished download.
+        """
+
+        content_length = r.headers.get('Content-length')
+        show_progress = progress and content_length
+
+        try:
+            with self._open(path) as f:
+                out = f
+                if show_progress or deadline or self.zero_copy or encoding:
+                    out = MonitoredWriter(f, deadline=deadline)
+
+                ticker = None
+                if show_progress:
                     widgets = [pb.Percentage(), ' ', pb.Bar(), ' ', pb.ETA(),
                                ' ', pb.FileTransferSpeed()]
                     pbar = pb.ProgressBar(widgets=widgets,
-                                          maxval=max_value).start()
+                                          max_value=int(content_length.strip())).start()
+                    # Content-Length counts the encoded bytes off the wire
+                    count = r.raw.tell if encoding else lambda: out.bytes_written
+                    ticker = ProgressTicker(pbar, count)
+                    ticker.start()
 
-                with open(tmp_file, 'wb') as f:
-                    for chunk in iter(lambda: r.raw.read(CHUNK_SIZE), ''):
-                        f.write(chunk)
-                        bytes_downloaded += CHUNK_SIZE
+                try:
+                    self._copy(r, f, out, content_length, encoding)
+                finally:
+                    if ticker:
+                        ticker.stop()
 
-                        if log_level <= logging.INFO and content_length:
-                            pbar.update(bytes_downloaded)
+                if show_progress:
+                    pbar.finish()
+        except BaseException:
+            if os.path.isfile(path):
+                os.remove(path)
+            raise
+        return out
 
-                        t1 = timedelta.total_seconds(datetime.now() - start_time)
-                        if timeout and t1 >= timeout:
-                            raise TimeoutError
+    def _conditional_headers(self, target):
+        """Return the headers asking for the file only if it has changed"""
 
-                if log_level <= logging.INFO and content_length:
-                    pbar.finish()
+        # The validators only apply as long as the file they describe exists
+        if not self.manifest or not os.path.isfile(target):
+            return {}
+        etag, mtime = self.manifest.validators(self.url)
+
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if mtime:
+            headers['If-Modified-Since'] = mtime
+        return headers
+
+    def _save_validators(self, target, headers):
+        """Remember the validators of the downloaded file for the next refresh"""
+
+        if self.manifest:
+            self.manifest.record(self.url, headers.get('ETag'),
+                                 headers.get('Last-Modified'),
+                                 os.path.getsize(target))
+
+    def _not_modified(self, target):
+        self.logger.info('File has not changed: %s', self.file)
+        # Record that the file is current as of now
+        os.utime(target)
+        if self.manifest:
+            self.manifest.touch(self.url)
+
+    def _copy(self, r, f, out, content_length, encoding):
+        """Copy the body of response r through the writer out into file f"""
+
+        # Plain-text bodies of known length can skip user space
+        if (self.zero_copy and content_length and not encoding and
+                r.url.startswith('http://') and hasattr(f, 'fileno')):
+            if splice_response(r, out, int(content_length.strip())):
+                return
+
+        # Inflated data can be larger than the buffer. urllib3 1.x
+        # readinto() then tries to resize the buffer, which raises
+        # BufferError while the memoryview below exists, so don't use
+        # readinto() for encoded bodies
+        if encoding:
+            while True:
+                chunk = r.raw.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                out.write(chunk)
+            return
+
+        # Reuse one buffer for the whole body instead of
+        # allocating a new bytes object for every chunk
+        buf = bytearray(CHUNK_SIZE)
+        view = memoryview(buf)
+        while True:
+            n = r.raw.readinto(buf)
+            if not n:
+                break
+            out.write(view[:n])
+
+    async def download_async(self, client, dest=None, timeout=None):
+        """Download the file through a shared httpx.AsyncClient"""
+
+        import httpx
+
+        target, tmp_file = self._prepare(dest)
+        headers = self._conditional_headers(target)
+        # Like the requests path, never wait forever for a connection. All
+        # files are started at once, so waiting for a free one is no error.
+        timeouts = httpx.Timeout(timeout, connect=CONNECT_TIMEOUT, pool=None)
+        loop = asyncio.get_running_loop()
+
+        for attempt in range(self.retry_attempts + 1):
+            try:
+                deadline = time.monotonic() + timeout if timeout else None
+                if self.rate_limiter:
+                    await asyncio.sleep(self.rate_limiter.reserve())
+                async with client.stream('GET', self.url, headers=headers,
+                                         timeout=timeouts) as r:
+                    # httpx counts 304 among the errors raise_for_status() raises
+                    if r.status_code == 304:
+                        self._not_modified(target)
+                        return
+                    r.raise_for_status()
+                    try:
+                        with self._open(tmp_file) as f:
+                            out = MonitoredWriter(f, deadline=deadline) if deadline else f
+                            # httpx decodes gzip/deflate itself; keep disk writes
+                            # off the event loop so other transfers keep streaming
+                            async for chunk in r.aiter_bytes(CHUNK_SIZE):
+                                await loop.run_in_executor(None, out.write, chunk)
+                    except BaseException:
+                        # Also after a cancellation, so no truncated file is left
+                        if os.path.isfile(tmp_file):
+                            os.remove(tmp_file)
+                        raise
                 break
-            except (requests.exceptions.RequestException, TimeoutError), e:
-                if tmp_file and os.path.isfile(tmp_file):
-                    os.remove(tmp_file)
-                if self.retry_attempts > 0:
-                    # Log only if multiple attempts are requested
-                    self.logger.warning('Download failed: "%s"' % str(e))
-                    self.logger.info('Will retry in %s seconds...' %
-                                     (self.retry_delay))
-                    time.sleep(self.retry_delay)
-                    self.logger.info("Retrying... (attempt %s)" % attempt)
-                if attempt >= self.retry_attempts:
+            except (httpx.HTTPError, TimeoutError) as e:
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
                     raise
-                time.sleep(self.retry_delay)
+                await asyncio.sleep(delay)
+                self.logger.info("Retrying... (attempt %s)", attempt + 2)
+
+        if self.atomic:
+            os.replace(tmp_file, target)
+        self._save_validators(target, r.headers)
+
+    def _retry_delay(self, e, attempt):
+        """Return the seconds to wait before repeating the failed attempt
+
+        Returns None when e should be raised instead, after the last
+        attempt or for errors which won't go away.
+        """
+
+        if attempt >= self.retry_attempts or not retryable(e):
+            return None
+        delay = backoff(self.retry_delay, attempt)
+        # httpx timeouts have no message
+        self.logger.warning('Download failed: "%s"', str(e) or type(e).__name__)
+        self.logger.info('Will retry in %.1f seconds...', delay)
+        return delay
 
-        os.rename(tmp_file, target)
+    def _open(self, path):
+        """Open the file the download is written to"""
+
+        if self.direct_io and hasattr(os, 'O_DIRECT'):
+            try:
+                return DirectWriter(path)
+            except OSError as e:
+                # Some file systems (e.g. tmpfs) don't support O_DIRECT
+                if e.errno != errno.EINVAL:
+                    raise
+                self.logger.warning('Direct I/O not supported for %s', path)
+        return open(path, 'wb')
 
     def parse(self):
         pass
@@ -114,12 +600,28 @@ class GameDayFile(object):
 
 class GameDayGame(GameDayFile):
 
-    def __init__(self, directory=None, url=None, file=None, date=None, visitor=None, home=None, game_no=None, logger=None):
+    __slots__ = ('date', 'visitor', 'home', 'game_no')
+
+    def __init__(self, directory=None, url=None, file=None, date=None, visitor=None, home=None, game_no=None, logger=None,
+                 session=None, atomic=True, direct_io=False, zero_copy=False,
+                 retry_attempts=0, retry_delay=10, rate_limiter=None,
+                 manifest=None):
         self.date = date
         self.visitor = visitor
         self.home = home
         self.game_no = game_no
-        GameDayFile.__init__(self, url=url, file=file, directory=directory, logger=logger)
+        GameDayFile.__init__(self, url=url, file=file, directory=directory, logger=logger,
+                             session=session, atomic=atomic, direct_io=direct_io,
+                             zero_copy=zero_copy, retry_attempts=retry_attempts,
+                             retry_delay=retry_delay, rate_limiter=rate_limiter,
+                             manifest=manifest)
+
+    def as_dict(self):
+        """Return what identifies the game, to recreate it without the listing"""
+
+        return {'directory': self.directory, 'visitor': self.visitor,
+                'home': self.home, 'game_no': self.game_no,
+                'url': self.url, 'file': self.file}
 
     def parse(self):
         pass
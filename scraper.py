@@ -4,28 +4,43 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from contextlib import nullcontext
 from datetime import datetime, timedelta
-from optparse import OptionParser, OptionGroup
+import importlib.util
+import json
 import os
-import pkg_resources
 import re
 import requests
-import sys
+from requests.adapters import HTTPAdapter
 import time
-import urllib
 import logging
-from urlparse import urlparse
 
-from parser import DirectoryParser
-from urlparse import urljoin
+from directory_parser import DirectoryParser
+from urllib.parse import urljoin
 
-import progressbar as pb
-
-from gameday_file import GameDayGame, TimeoutError
+from gameday_file import GameDayGame, Manifest, RateLimiter, backoff, retryable
 
 # Base URL for the path to all game files
 BASE_URL = 'http://gd2.mlb.com/components/'
 
+# File in the destination directory caching directory listings
+LISTING_CACHE = '.listing_cache.json'
+
+# Seconds a cached listing of a day which may still change is reused
+LISTING_TTL = 24 * 60 * 60
+
+# Database in the destination directory recording the downloaded files
+MANIFEST = '.manifest.db'
+
+# Directory in the destination directory caching the games found per date
+GAME_CACHE = '.game_cache'
+
+# Seconds a file which was not found is skipped before it is requested again
+NEG_CACHE_TTL = 24 * 60 * 60
+
 class NotSupportedError(Exception):
     """Exception for a build not being supported"""
     def __init__(self, message):
@@ -44,73 +59,400 @@ class NotImplementedError(Exception):
 
 # http://gd2.mlb.com/components/game/mlb/year_2015/month_05/day_07/gid_2015_05_07_balmlb_nyamlb_1/inning/inning_all.xml
 
+def make_session(workers):
+    """Return a session sized for the given number of download workers"""
+
+    # Share one keep-alive connection pool between the directory listing
+    # and all file downloads instead of reconnecting for every request
+    session = requests.Session()
+    # Every worker may hold a connection while the listing is streamed
+    # on another one. All requests go to one host, so one pool is enough.
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers * 2,
+                          max_retries=0)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def daterange(start, end):
+    """Yield the dates (YYYY-MM-DD) from start to end, both included"""
+
+    date = datetime.strptime(start, '%Y-%m-%d')
+    end = datetime.strptime(end, '%Y-%m-%d')
+    while date <= end:
+        yield date.strftime('%Y-%m-%d')
+        date += timedelta(days=1)
+
 class Scraper(object):
     """Generic class to download an file from the server"""
 
     def __init__(self, retry_attempts=0, retry_delay=10,
                  timeout=None,
                  log_level='INFO',
-                 base_url=None, *args, **kwargs):
+                 base_url=None, workers=8, atomic=True, direct_io=False,
+                 http2=False, zero_copy=False, listing_cache=True,
+                 session=None, executor=None, parser='html', rate_limit=0,
+                 *args, **kwargs):
 
         self.retry_attempts = retry_attempts
         self.retry_delay = retry_delay
         self.timeout = timeout
+        self.workers = workers
+        self.atomic = atomic
+        self.direct_io = direct_io
+        self.http2 = http2
+        self.zero_copy = zero_copy
+        self.listing_cache = listing_cache
+        if parser == 'lxml' and importlib.util.find_spec('lxml') is None:
+            raise NotSupportedError('The lxml parser requires lxml')
+        self.parser = parser
+        # Shared by the listing and all downloads so their sum is paced
+        self.rate_limiter = RateLimiter(rate_limit)
         self.refresh = kwargs['refresh']
         self.logger = logging.getLogger('scraper')
-        ch = logging.StreamHandler()
-        ch.setLevel(logging.INFO)
-        self.logger.addHandler(ch)
-        self.logger.setLevel(logging.INFO)
+        # Scrapers of several dates share the logger
+        if not self.logger.handlers:
+            self.logger.addHandler(logging.StreamHandler())
+        self.logger.setLevel(log_level)
+        # Resolved once so per-file decisions don't walk the logger hierarchy
+        self._info_enabled = self.logger.isEnabledFor(logging.INFO)
         self.dest = kwargs['dest']
         if self.dest:
             self.dest = os.path.abspath(self.dest)
-            if not os.path.exists(self.dest):
-                os.mkdir(self.dest)
+            os.makedirs(self.dest, exist_ok=True)
         else:
             self.dest = os.path.abspath(os.path.curdir)
 
-    def files(self):
-        attempt = 0
-        parser = None
-        while parser is None:
-            attempt += 1
+        # The files found in the listing
+        self.files = []
+
+        # One directory read tells which files are already on disk
+        self._existing = set(entry.name for entry in os.scandir(self.dest))
+
+        # ETag and Last-Modified of each download, to revalidate on refresh
+        self.manifest = Manifest(os.path.join(self.dest, MANIFEST))
+        # It also remembers files which answered 404. Games which were
+        # rained out never get their files, so don't ask again each run.
+        self.manifest.prune_missing(time.time() - NEG_CACHE_TTL)
+
+        # A session and executor passed in are shared with other scrapers,
+        # which is why only our own are closed
+        self._own_session = session is None
+        self.session = session or make_session(self.workers)
+        self.executor = executor
+
+    def _executor(self):
+        """Return a context manager giving the executor for downloads"""
+
+        if self.executor:
+            return nullcontext(self.executor)
+        return ThreadPoolExecutor(max_workers=self.workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Close all pooled connections to the server"""
+
+        if self._own_session:
+            self.session.close()
+        self.manifest.close()
+
+    def _read_listing_cache(self):
+        """Load the cached directory listings, keyed by URL"""
+
+        if not self.listing_cache:
+            return {}
+        try:
+            with open(os.path.join(self.dest, LISTING_CACHE), 'r') as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def _write_listing_cache(self, cache):
+        path = os.path.join(self.dest, LISTING_CACHE)
+        tmp_path = path + '.part'
+        with open(tmp_path, 'w') as f:
+            json.dump(cache, f)
+        os.replace(tmp_path, path)
+
+    def _fetch_listing(self, consume=None):
+        """Request the directory listing, retrying on failures
+
+        With consume, the listing is streamed and each batch of entries is
+        passed to it as soon as it has been parsed. A failure part way
+        through restarts the listing, so consume may see entries again.
+        """
+
+        # Revalidate the last listing of this URL instead of fetching it again
+        cached = self._read_listing_cache().get(self.base_url, {})
+
+        for attempt in range(self.retry_attempts + 1):
             try:
+                self.rate_limiter.acquire()
                 # Retrieve all entries from the remote virtual folder
                 parser = DirectoryParser(self.base_url,
-                                         timeout=self.timeout)
+                                         timeout=self.timeout,
+                                         session=self.session,
+                                         etag=cached.get('etag'),
+                                         last_modified=cached.get('last_modified'),
+                                         stream=consume is not None,
+                                         parser=self.parser)
+                if parser.not_modified:
+                    parser.entries = cached['entries']
+                    if consume:
+                        consume(parser.entries)
+                elif consume:
+                    # Reading the body can fail as well as the request
+                    for batch in parser.iter_batches():
+                        consume(batch)
                 if not parser.entries:
                     raise NotFoundError('No entries found', self.base_url)
+                break
 
-            except (NotFoundError, requests.exceptions.RequestException), e:
-                if self.retry_attempts > 0:
-                    # Log only if multiple attempts are requested
-                    #self.logger.warning("Build not found: '%s'" % e.message)
-                    #self.logger.info('Will retry in %s seconds...' %
-                    #                 (self.retry_delay))
-                    time.sleep(self.retry_delay)
-                    #self.logger.info("Retrying... (attempt %s)" % attempt)
-
-                if attempt >= self.retry_attempts:
-                    if hasattr(e, 'response') and \
+            except (NotFoundError, requests.exceptions.RequestException) as e:
+                if attempt >= self.retry_attempts or not retryable(e):
+                    if getattr(e, 'response', None) is not None and \
                             e.response.status_code == 404:
                         message = "Specified url has not been found"
                         raise NotFoundError(message, e.response.url)
                     else:
                         raise
 
-        self.files = []
+                delay = backoff(self.retry_delay, attempt)
+                self.logger.warning("Listing failed: %s", e)
+                self.logger.info('Will retry in %.1f seconds...', delay)
+                time.sleep(delay)
+
+        return parser
+
+    def _cache_listing(self, parser):
+        if not self.listing_cache:
+            return
+        cache = self._read_listing_cache()
+        cache[self.base_url] = {'etag': parser.etag,
+                                'last_modified': parser.last_modified,
+                                'entries': parser.entries,
+                                'fetched': time.time()}
+        self._write_listing_cache(cache)
+
+    def _cached_listing(self):
+        """Return the cached entries of the listing if they are still fresh
+
+        Returns None when the listing has to be requested from the server.
+        """
+
+        # Refreshing looks for games added since the listing was cached
+        if self.refresh:
+            return None
+        cached = self._read_listing_cache().get(self.base_url)
+        if not cached:
+            return None
+        # Listings fetched once the day was over never change, so they
+        # don't expire
+        fetched = cached.get('fetched', 0)
+        if not self.listing_is_final(fetched) and \
+                time.time() - fetched >= LISTING_TTL:
+            return None
+        self.logger.info("Using the cached listing of %s", self.base_url)
+        return cached['entries']
+
+    def discover(self):
+        """Find the files listed in the directory"""
+
+        files = None
+        entries = self._cached_listing()
+        if entries is not None:
+            files = self.load_files()
+        else:
+            parser = self._fetch_listing()
+            self._cache_listing(parser)
+            entries = parser.entries
 
-        self.parse_entries(parser.entries)
+        if files is None:
+            files = self.parse_entries(entries)
+            self.save_files(files)
+        self.files = files
 
-    def parse_entries(self):
+    def parse_entries(self, entries):
         """Override for specific types of files that we are looking for"""
+        return []
+
+    def load_files(self):
+        """Override to return the files saved for the cached listing
+
+        Only called while the cached listing is fresh. Returns None when
+        nothing has been saved.
+        """
+        return None
+
+    def save_files(self, files):
+        """Override to save the files found in the listing for load_files()"""
         pass
 
+    def _pending(self, files):
+        """Return the files which still have to be downloaded"""
+
+        # Refreshing downloads everything, so there is nothing to check
+        if self.refresh:
+            return list(files)
+
+        pending = []
+        now = time.time()
+        for file in files:
+            if file.file in self._existing:
+                self.logger.info("File has already been downloaded: %s", file.file)
+            elif now - (self.manifest.missing_since(file.url) or 0) < NEG_CACHE_TTL:
+                self.logger.info("File was recently not found: %s", file.url)
+            else:
+                pending.append(file)
+        return pending
+
+    def _failed(self, file, e):
+        """Log a failed download and remember files which don't exist"""
+
+        # requests and httpx both attach the response to status errors
+        response = getattr(e, 'response', None)
+        if getattr(response, 'status_code', None) == 404:
+            self.manifest.record_missing(file.url)
+        self.logger.warning("Failed to download %s: %s", file.file,
+                            str(e) or type(e).__name__)
+
+    def listing_is_final(self, fetched):
+        """Override to tell whether a listing fetched at that time is complete"""
+        return False
+
+    def _download_one(self, file):
+        # Progress bars from several threads would overwrite each other
+        file.download(dest=self.dest, timeout=self.timeout,
+                      progress=self._info_enabled and self.workers <= 1)
+
+    def _collect(self, futures):
+        """Wait for the downloads, logging failures instead of aborting
+
+        futures maps each future to the file it is downloading.
+        """
+
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                self._failed(futures[future], e)
+
+    def _cancel(self, futures):
+        """Drop the queued downloads and wait for the running ones
+
+        Called when the user interrupts, so the executor doesn't go on with
+        the queue and no thread still writes when the scraper is closed.
+        """
+
+        for future in futures:
+            future.cancel()
+        wait(futures)
+
     def download(self):
         """Download the specified files"""
 
-        for file in self.files:
-            file.download(dest=self.dest, refresh=self.refresh, timeout=self.timeout)
+        if self.http2:
+            asyncio.run(self.download_async())
+            return
+
+        # Downloads are network-bound, so threads overlap the time spent
+        # waiting on the server
+        with self._executor() as executor:
+            futures = dict((executor.submit(self._download_one, file), file)
+                           for file in self._pending(self.files))
+            try:
+                self._collect(futures)
+            except KeyboardInterrupt:
+                self._cancel(futures)
+                raise
+
+    def run(self):
+        """Find the files and download them
+
+        Downloads start as soon as the first part of the directory listing
+        has been parsed, instead of waiting for the complete listing.
+        """
+
+        if self.http2:
+            self.discover()
+            self.download()
+            return
+
+        parser = None
+        loaded = None
+        entries = self._cached_listing()
+        if entries is not None:
+            loaded = self.load_files()
+
+        # Files by name, as a restarted listing finds the same files again
+        found = {}
+        with self._executor() as executor:
+            futures = {}
+
+            def submit(files):
+                new = []
+                for file in files:
+                    if file.file not in found:
+                        found[file.file] = file
+                        new.append(file)
+                for file in self._pending(new):
+                    futures[executor.submit(self._download_one, file)] = file
+
+            def consume(batch):
+                submit(self.parse_entries(batch))
+
+            try:
+                if loaded is not None:
+                    submit(loaded)
+                elif entries is not None:
+                    consume(entries)
+                else:
+                    parser = self._fetch_listing(consume=consume)
+                self._collect(futures)
+            except KeyboardInterrupt:
+                self._cancel(futures)
+                raise
+            except Exception:
+                # Finish the downloads found before the listing failed
+                self._collect(futures)
+                raise
+            finally:
+                self.files = list(found.values())
+
+        if parser:
+            self._cache_listing(parser)
+        if loaded is None:
+            self.save_files(self.files)
+
+    async def download_async(self):
+        """Download the specified files concurrently with httpx
+
+        httpx negotiates HTTP/2 over TLS, multiplexing every transfer on one
+        connection. Plain http:// servers are spoken to in HTTP/1.1, which
+        is why the pool still allows one connection per worker.
+        """
+
+        try:
+            import httpx
+            limits = httpx.Limits(max_connections=self.workers,
+                                  max_keepalive_connections=self.workers)
+            client = httpx.AsyncClient(http2=True, limits=limits)
+        except ImportError:
+            raise NotSupportedError('HTTP/2 downloads require httpx[http2]')
+
+        pending = self._pending(self.files)
+        async with client:
+            results = await asyncio.gather(*(file.download_async(client, dest=self.dest,
+                                                                 timeout=self.timeout)
+                                             for file in pending),
+                                           return_exceptions=True)
+        for file, result in zip(pending, results):
+            if isinstance(result, Exception):
+                self._failed(file, result)
 
     def process(self):
         """Process the files. This usually means populating the database."""
@@ -118,8 +460,11 @@ class Scraper(object):
         for file in self.files:
             file.process()
 
-game_url_pattern = re.compile('gid_([\d]+)_([\d]+)_([\d]+)_([a-z]{3})mlb_([a-z]{3})mlb_(\d)/')
+# Matches one game directory per line of the joined directory listing
+game_url_pattern = re.compile(r'^(gid_(\d{4})_(\d{2})_(\d{2})_([a-z]{3})mlb_([a-z]{3})mlb_(\d)/)',
+                              re.MULTILINE | re.ASCII)
 GAMES_URL = 'game/mlb/'
+INNING_URL = 'inning/inning_all.xml'
 
 
 class GameScraper(Scraper):
@@ -134,7 +479,9 @@ class GameScraper(Scraper):
                 self.date = datetime.strptime(self.date, '%Y-%m-%d')
             else:
                 # A date (without time) has been specified. Use yesterday's games since today's are not finished yet.
-                self.date = datetime.today() - timedelta(days=1)
+                # At midnight like a parsed date, which listing_is_final needs
+                yesterday = datetime.today() - timedelta(days=1)
+                self.date = datetime(yesterday.year, yesterday.month, yesterday.day)
             self.date_url = 'year_%d/month_%02d/day_%02d/' % (self.date.year, self.date.month, self.date.day)
         except:
             raise ValueError('%s is not a valid date' % self.date)
@@ -148,92 +495,221 @@ class GameScraper(Scraper):
         Scraper.__init__(self, base_url=self.base_url, *args, **kwargs)
 
 
+    def listing_is_final(self, fetched):
+        # Games finishing late may still be added on the following day, so
+        # only a listing fetched after that day is complete
+        return fetched >= (self.date + timedelta(days=2)).timestamp()
+
+    def _game_arguments(self):
+        """Return the arguments which are the same for every game"""
+
+        return dict(date=self.date, logger=self.logger, session=self.session,
+                    atomic=self.atomic, direct_io=self.direct_io,
+                    zero_copy=self.zero_copy, retry_attempts=self.retry_attempts,
+                    retry_delay=self.retry_delay, rate_limiter=self.rate_limiter,
+                    manifest=self.manifest)
+
     def parse_entries(self, entries):
-        for entry in entries:
-            match = game_url_pattern.match(entry)
-            if match:
-                directory = match.group(0)
-                visitor = match.group(4)
-                home = match.group(5)
-                game_no = match.group(6)
-                url = urljoin(self.base_url, directory)
-                url = urljoin(url, 'inning/inning_all.xml')
-                file_name = os.path.split(directory)[0] + '.xml'
-                file = GameDayGame(directory=directory, date=self.date, visitor=visitor, home=home,
-                                   game_no=game_no, url=url, file=file_name, logger=self.logger)
-                self.files.append(file)
+        # Match all game directories in one pass inside the regex engine.
+        # Other entries (e.g. scoreboards) are dropped before joining.
+        matches = game_url_pattern.findall(
+            '\n'.join(entry for entry in entries if entry.startswith('gid_')))
+        shared = self._game_arguments()
+        # base_url ends with the date directory's slash and directory
+        # with its own, so plain concatenation gives the right URL
+        base_url = self.base_url
+        return [GameDayGame(directory=directory, visitor=visitor, home=home,
+                            game_no=game_no, url=base_url + directory + INNING_URL,
+                            file=directory[:-1] + '.xml', **shared)
+                for directory, year, month, day, visitor, home, game_no in matches]
+
+    def _game_cache_path(self):
+        return os.path.join(self.dest, GAME_CACHE,
+                            self.date.strftime('%Y-%m-%d') + '.json')
+
+    def load_files(self):
+        if not self.listing_cache or self.refresh:
+            return None
+        try:
+            with open(self._game_cache_path(), 'r') as f:
+                cached = json.load(f)
+        except (IOError, ValueError):
+            return None
+        # Games found under another --url point to another server
+        if cached.get('base_url') != self.base_url:
+            return None
+
+        shared = self._game_arguments()
+        return [GameDayGame(**dict(game, **shared)) for game in cached['games']]
+
+    def save_files(self, files):
+        if not self.listing_cache:
+            return
+        path = self._game_cache_path()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.part'
+        with open(tmp_path, 'w') as f:
+            json.dump({'base_url': self.base_url,
+                       'games': [game.as_dict() for game in files]}, f)
+        os.replace(tmp_path, path)
+
+def positive_int(value):
+    """argparse type for counts which have to be at least 1"""
+
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError('%s is not a positive number' % value)
+    return number
 
 def cli():
     """Main function for the downloader"""
 
-    usage = 'usage: %prog [options]'
-    parser = OptionParser(usage=usage, description=__doc__)
-    parser.add_option('--url',
-                      dest='url',
-                      metavar='URL',
-                      help='URL of game directories. Default is known Game Day url.')
-    parser.add_option('--retry-attempts',
-                      dest='retry_attempts',
-                      default=0,
-                      type=int,
-                      metavar='RETRY_ATTEMPTS',
-                      help='Number of times the download will be attempted in '
-                           'the event of a failure, default: %default')
-    parser.add_option('--retry-delay',
-                      dest='retry_delay',
-                      default=10.,
-                      type=float,
-                      metavar='RETRY_DELAY',
-                      help='Amount of time (in seconds) to wait between retry '
-                           'attempts, default: %default')
-    parser.add_option('--timeout',
-                      dest='timeout',
-                      type=float,
-                      metavar='TIMEOUT',
-                      help='Amount of time (in seconds) until a download times'
-                           ' out')
-    parser.add_option('--log-level',
-                      action='store',
-                      dest='log_level',
-                      default='INFO',
-                      metavar='LOG_LEVEL',
-                      help='Threshold for log output (default: %default)')
-    parser.add_option('--date',
-                     dest='date',
-                     metavar='DATE',
-                     help='Date of the games (YYYY-MM-DD), default: yesterday')
-    parser.add_option('--refresh',
-                      dest='refresh',
-                      default=False,
-                      metavar='REFRESH',
-                      help='Download files even if they already exist (default: %default)')
-    parser.add_option('--dest',
-                      dest='dest',
-                      default='',
-                      metavar='DEST',
-                      help='Destination directory for downloaded files. Current directory if none specified')
-
-    (options, args) = parser.parse_args()
-
-    # Instantiate scraper and download the build
-    scraper_keywords = {'base_url': options.url,
-                        'retry_attempts': options.retry_attempts,
-                        'retry_delay': options.retry_delay,
-                        'timeout': options.timeout,
-                        'log_level': options.log_level,
-                        'date': options.date,
-                        'refresh': options.refresh,
-                        'dest': options.dest}
-
-    kwargs = scraper_keywords.copy()
-
-    scraper = GameScraper(**kwargs)
-
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--url',
+                        dest='base_url',
+                        metavar='URL',
+                        help='URL of game directories. Default is known Game Day url.')
+    parser.add_argument('--retry-attempts',
+                        dest='retry_attempts',
+                        default=0,
+                        type=int,
+                        metavar='RETRY_ATTEMPTS',
+                        help='Number of times the download will be attempted in '
+                             'the event of a failure, default: %(default)s')
+    parser.add_argument('--retry-delay',
+                        dest='retry_delay',
+                        default=10.0,
+                        type=float,
+                        metavar='RETRY_DELAY',
+                        help='Amount of time (in seconds) to wait between retry '
+                             'attempts, default: %(default)s')
+    parser.add_argument('--workers',
+                        dest='workers',
+                        default=8,
+                        type=positive_int,
+                        metavar='WORKERS',
+                        help='Number of files downloaded in parallel, '
+                             'default: %(default)s')
+    parser.add_argument('--rate-limit',
+                        dest='rate_limit',
+                        default=2.0,
+                        type=float,
+                        metavar='RATE_LIMIT',
+                        help='Maximum number of requests sent per second, 0 for '
+                             'no limit, default: %(default)s')
+    parser.add_argument('--timeout',
+                        dest='timeout',
+                        type=float,
+                        metavar='TIMEOUT',
+                        help='Amount of time (in seconds) until a download times'
+                             ' out')
+    parser.add_argument('--log-level',
+                        action='store',
+                        dest='log_level',
+                        default='INFO',
+                        metavar='LOG_LEVEL',
+                        help='Threshold for log output (default: %(default)s)')
+    parser.add_argument('--date',
+                        dest='date',
+                        metavar='DATE',
+                        help='Date of the games (YYYY-MM-DD), default: yesterday')
+    parser.add_argument('--start-date',
+                        dest='start_date',
+                        metavar='START_DATE',
+                        help='First date of a range of dates to download the '
+                             'games of (YYYY-MM-DD)')
+    parser.add_argument('--end-date',
+                        dest='end_date',
+                        metavar='END_DATE',
+                        help='Last date of the range (YYYY-MM-DD), '
+                             'default: the start date')
+    parser.add_argument('--refresh',
+                        dest='refresh',
+                        default=False,
+                        metavar='REFRESH',
+                        help='Download files even if they already exist (default: %(default)s)')
+    parser.add_argument('--no-atomic',
+                        dest='atomic',
+                        action='store_false',
+                        default=True,
+                        help='Write straight to the destination file instead of '
+                             'renaming a temporary .part file into place')
+    parser.add_argument('--direct-io',
+                        dest='direct_io',
+                        action='store_true',
+                        default=False,
+                        help='Write files with O_DIRECT to keep them out of the '
+                             'page cache (Linux only)')
+    parser.add_argument('--zero-copy',
+                        dest='zero_copy',
+                        action='store_true',
+                        default=False,
+                        help='Splice uncompressed http:// bodies from the socket '
+                             'into the file in the kernel (Linux only)')
+    parser.add_argument('--http2',
+                        dest='http2',
+                        action='store_true',
+                        default=False,
+                        help='Download with httpx over HTTP/2 where the server '
+                             'supports it (requires httpx[http2])')
+    parser.add_argument('--no-dir-cache',
+                        dest='listing_cache',
+                        action='store_false',
+                        default=True,
+                        help='Always request the directory listing from the '
+                             'server instead of using the cached one')
+    parser.add_argument('--parser',
+                        dest='parser',
+                        choices=['html', 'lxml'],
+                        default='html',
+                        help='Parser for directory listings; lxml is faster '
+                             'but has to be installed, default: %(default)s')
+    parser.add_argument('--dest',
+                        dest='dest',
+                        default='',
+                        metavar='DEST',
+                        help='Destination directory for downloaded files. Current directory if none specified')
+
+    options = parser.parse_args()
+
+    # The options are named after the scraper's arguments, except for
+    # the range of dates which is handled here
+    kwargs = vars(options)
+    start_date = kwargs.pop('start_date')
+    end_date = kwargs.pop('end_date')
+
+    if end_date and not start_date:
+        parser.error('--end-date requires --start-date')
+    if start_date:
+        try:
+            dates = list(daterange(start_date, end_date or start_date))
+        except ValueError:
+            parser.error('dates have to be given as YYYY-MM-DD')
+        if not dates:
+            parser.error('--end-date is before --start-date')
+    else:
+        dates = [kwargs['date']]
+
+    # All dates share the connection pool and the download threads
+    session = make_session(options.workers)
     try:
-        scraper.files()
-        scraper.download()
+        with ThreadPoolExecutor(max_workers=options.workers) as executor:
+            for date in dates:
+                kwargs['date'] = date
+                with GameScraper(session=session, executor=executor,
+                                 **kwargs) as scraper:
+                    try:
+                        scraper.run()
+                    except Exception as e:
+                        # One failed day shouldn't end a backfill
+                        if len(dates) == 1:
+                            raise
+                        scraper.logger.warning('Failed to download the games of %s: %s',
+                                               date, e)
     except KeyboardInterrupt:
-        print "\nDownload interrupted by the user"
+        print("\nDownload interrupted by the user")
+    finally:
+        session.close()
 
 if __name__ == "__main__":
     cli()
@@ -10,18 +10,20 @@ from setuptools import setup
 
 try:
     here = os.path.dirname(os.path.abspath(__file__))
-    description = file(os.path.join(here, 'README.md')).read()
+    with open(os.path.join(here, 'README.md')) as f:
+        description = f.read()
 except (OSError, IOError):
     description = None
 
 version = '0.1'
 
-deps = ['requests == 1.2.2',
-      ]
+deps = ['requests >= 2.28',
+        'progressbar2 >= 4.0',
+        ]
 
 setup(name='game_day_scraper',
       version=version,
-      description='Script to download game records from MLB's GameDay server.',
+      description="Script to download game records from MLB's GameDay server.",
       long_description=description,
       # Get strings from http://pypi.python.org/pypi?%3Aaction=list_classifiers
       classifiers=[],
@@ -30,7 +32,11 @@ setup(name='game_day_scraper',
       author_email='sydpolk@gmail.com',
       url='http://github.com/sydvicious/game_day_scraper',
       license='Mozilla Public License 2.0 (MPL 2.0)',
-      packages=['game_day_scraper'],
+      py_modules=['directory_parser', 'gameday_file', 'scraper'],
       zip_safe=False,
+      python_requires='>=3.7',
       install_requires=deps,
+      extras_require={'http2': ['httpx[http2]'],
+                      'lxml': ['lxml >= 4.9']},
+      entry_points={'console_scripts': ['gameday-scrape = scraper:cli']},
       )
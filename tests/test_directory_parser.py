@@ -0,0 +1,80 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import unittest
+
+try:
+    import lxml
+except ImportError:
+    lxml = None
+
+from directory_parser import CHUNK_SIZE, DirectoryParser
+
+
+class FakeResponse(object):
+    """Response handing out its body in pieces of the requested size"""
+
+    def __init__(self, body):
+        self.body = body
+        self.status_code = 200
+        self.headers = {}
+        self.encoding = 'utf-8'
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size=1, decode_unicode=False):
+        for start in range(0, len(self.body), chunk_size):
+            yield self.body[start:start + chunk_size]
+
+    def close(self):
+        pass
+
+
+class FakeSession(object):
+
+    def __init__(self, body):
+        self.body = body
+
+    def get(self, url, **kwargs):
+        return FakeResponse(self.body)
+
+
+def listing(names):
+    return ('<html><head><title>Index of /day_09/</title></head><body><ul>' +
+            ''.join('<li><a href="%s">%s</a></li>\n' % (name, name) for name in names) +
+            '</ul></body></html>')
+
+
+class DirectoryParserTest(unittest.TestCase):
+
+    def test_entry_across_chunk_boundary(self):
+        names = ['gid_2015_05_09_atlmlb_wasmlb_%d/' % i for i in range(400)]
+        body = listing(names)
+        # The listing is long enough that chunk boundaries fall inside links
+        self.assertGreater(len(body), 2 * CHUNK_SIZE)
+
+        parser = DirectoryParser('http://localhost/day_09/',
+                                 session=FakeSession(body))
+        self.assertEqual(parser.entries, names)
+
+    def test_streamed_batches(self):
+        names = ['gid_2015_05_09_atlmlb_wasmlb_%d/' % i for i in range(400)]
+        parser = DirectoryParser('http://localhost/day_09/',
+                                 session=FakeSession(listing(names)), stream=True)
+
+        batches = list(parser.iter_batches())
+        self.assertGreater(len(batches), 1)
+        self.assertEqual([entry for batch in batches for entry in batch], names)
+
+    @unittest.skipIf(lxml is None, 'lxml is not installed')
+    def test_lxml_entry_across_chunk_boundary(self):
+        names = ['gid_2015_05_09_atlmlb_wasmlb_%d/' % i for i in range(400)]
+        parser = DirectoryParser('http://localhost/day_09/',
+                                 session=FakeSession(listing(names)), parser='lxml')
+        self.assertEqual(parser.entries, names)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,170 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import requests
+
+from gameday_file import RETRY_DELAY_CAP, GameDayFile, RateLimiter, backoff, retryable
+
+
+class BrokenRaw(object):
+    """Body which fails after its first read"""
+
+    def __init__(self):
+        self.reads = 0
+        self.decode_content = False
+
+    def readinto(self, buf):
+        self.reads += 1
+        if self.reads > 1:
+            raise RuntimeError('connection lost')
+        buf[:5] = b'<xml>'
+        return 5
+
+
+class FakeResponse(object):
+
+    def __init__(self):
+        self.status_code = 200
+        self.headers = {}
+        self.url = 'http://localhost/game.xml'
+        self.raw = BrokenRaw()
+
+    def raise_for_status(self):
+        pass
+
+
+class FakeSession(object):
+
+    def __init__(self, error=None):
+        self.error = error
+        self.requests = 0
+
+    def get(self, url, **kwargs):
+        self.requests += 1
+        if self.error:
+            raise self.error
+        return FakeResponse()
+
+
+class DownloadCleanupTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dest = tempfile.mkdtemp()
+        self.target = os.path.join(self.dest, 'game.xml')
+
+    def tearDown(self):
+        shutil.rmtree(self.dest)
+
+    def download(self, session):
+        file = GameDayFile(url='http://localhost/game.xml', file='game.xml',
+                           logger=logging.getLogger('test'), session=session,
+                           atomic=False)
+        file.download(dest=self.dest, progress=False)
+
+    def test_failed_write_leaves_no_truncated_file(self):
+        self.assertRaises(RuntimeError, self.download, FakeSession())
+        self.assertFalse(os.path.exists(self.target))
+
+    def test_failed_request_keeps_existing_file(self):
+        with open(self.target, 'w') as f:
+            f.write('<game/>')
+
+        error = requests.exceptions.ConnectionError('refused')
+        self.assertRaises(requests.exceptions.ConnectionError,
+                          self.download, FakeSession(error))
+        with open(self.target) as f:
+            self.assertEqual(f.read(), '<game/>')
+
+
+def http_error(status_code):
+    response = requests.Response()
+    response.status_code = status_code
+    return requests.exceptions.HTTPError(response=response)
+
+
+class RetryableTest(unittest.TestCase):
+
+    def test_errors_without_response(self):
+        self.assertTrue(retryable(requests.exceptions.ConnectionError('refused')))
+        self.assertTrue(retryable(requests.exceptions.ReadTimeout()))
+
+    def test_client_errors(self):
+        for status_code in (400, 403, 404, 410):
+            self.assertFalse(retryable(http_error(status_code)))
+
+    def test_timeout_and_rate_limit(self):
+        self.assertTrue(retryable(http_error(408)))
+        self.assertTrue(retryable(http_error(429)))
+
+    def test_server_errors(self):
+        for status_code in (500, 502, 503):
+            self.assertTrue(retryable(http_error(status_code)))
+
+
+class BackoffTest(unittest.TestCase):
+
+    def test_doubles_within_jitter(self):
+        for attempt in range(4):
+            delay = backoff(1, attempt)
+            self.assertGreaterEqual(delay, 0.5 * 2 ** attempt)
+            self.assertLessEqual(delay, 1.5 * 2 ** attempt)
+
+    def test_capped(self):
+        self.assertLessEqual(backoff(10, 20), 1.5 * RETRY_DELAY_CAP)
+        self.assertGreaterEqual(backoff(10, 20), 0.5 * RETRY_DELAY_CAP)
+
+
+class RetryLoopTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dest = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dest)
+
+    def download(self, session, retry_attempts):
+        file = GameDayFile(url='http://localhost/game.xml', file='game.xml',
+                           logger=logging.getLogger('test'), session=session,
+                           retry_attempts=retry_attempts, retry_delay=0)
+        with mock.patch('gameday_file.time.sleep') as sleep:
+            try:
+                file.download(dest=self.dest, progress=False)
+            except requests.exceptions.RequestException:
+                pass
+        return sleep.call_count
+
+    def test_no_sleep_after_last_attempt(self):
+        session = FakeSession(requests.exceptions.ConnectionError('refused'))
+        self.assertEqual(self.download(session, retry_attempts=2), 2)
+        self.assertEqual(session.requests, 3)
+
+    def test_client_error_not_retried(self):
+        session = FakeSession(http_error(404))
+        self.assertEqual(self.download(session, retry_attempts=2), 0)
+        self.assertEqual(session.requests, 1)
+
+
+class RateLimiterTest(unittest.TestCase):
+
+    def test_spaces_requests(self):
+        limiter = RateLimiter(4)
+        waits = [limiter.reserve() for i in range(3)]
+        self.assertEqual(waits[0], 0)
+        self.assertAlmostEqual(waits[1], 0.25, places=2)
+        self.assertAlmostEqual(waits[2], 0.5, places=2)
+
+    def test_no_limit(self):
+        limiter = RateLimiter(0)
+        self.assertEqual([limiter.reserve() for i in range(3)], [0, 0, 0])
+
+
+if __name__ == '__main__':
+    unittest.main()
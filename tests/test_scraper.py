@@ -0,0 +1,91 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from datetime import datetime, timedelta
+import shutil
+import tempfile
+import unittest
+
+from scraper import GameScraper, daterange
+
+
+class ListingIsFinalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dest = tempfile.mkdtemp()
+        self.scraper = GameScraper(date='2015-05-09', dest=self.dest, refresh=False)
+
+    def tearDown(self):
+        self.scraper.close()
+        shutil.rmtree(self.dest)
+
+    def test_fetched_while_games_may_be_added(self):
+        for fetched in (datetime(2015, 5, 9, 20), datetime(2015, 5, 10, 23, 59)):
+            self.assertFalse(self.scraper.listing_is_final(fetched.timestamp()))
+
+    def test_fetched_after_the_following_day(self):
+        for fetched in (datetime(2015, 5, 11), datetime(2020, 1, 1)):
+            self.assertTrue(self.scraper.listing_is_final(fetched.timestamp()))
+
+    def test_default_date_is_yesterday_at_midnight(self):
+        scraper = GameScraper(dest=self.dest, refresh=False)
+        try:
+            yesterday = datetime.today().date() - timedelta(days=1)
+            self.assertEqual(scraper.date, datetime(yesterday.year, yesterday.month,
+                                                    yesterday.day))
+        finally:
+            scraper.close()
+
+
+class DaterangeTest(unittest.TestCase):
+
+    def test_includes_both_ends(self):
+        self.assertEqual(list(daterange('2015-04-29', '2015-05-02')),
+                         ['2015-04-29', '2015-04-30', '2015-05-01', '2015-05-02'])
+
+    def test_single_day(self):
+        self.assertEqual(list(daterange('2015-05-09', '2015-05-09')), ['2015-05-09'])
+
+    def test_reversed(self):
+        self.assertEqual(list(daterange('2015-05-10', '2015-05-09')), [])
+
+
+class ParseEntriesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dest = tempfile.mkdtemp()
+        self.scraper = GameScraper(date='2015-05-09', base_url='http://localhost/',
+                                   dest=self.dest, refresh=False)
+
+    def tearDown(self):
+        self.scraper.close()
+        shutil.rmtree(self.dest)
+
+    def test_games(self):
+        games = self.scraper.parse_entries(['Index of /day_09/', '../',
+                                            'gid_2015_05_09_atlmlb_wasmlb_1/',
+                                            'scoreboard.xml',
+                                            'gid_2015_05_09_cinmlb_chamlb_2/'])
+        self.assertEqual([game.file for game in games],
+                         ['gid_2015_05_09_atlmlb_wasmlb_1.xml',
+                          'gid_2015_05_09_cinmlb_chamlb_2.xml'])
+        game = games[1]
+        self.assertEqual((game.visitor, game.home, game.game_no), ('cin', 'cha', '2'))
+        self.assertEqual(game.url, 'http://localhost/game/mlb/year_2015/month_05/day_09/'
+                                   'gid_2015_05_09_cinmlb_chamlb_2/inning/inning_all.xml')
+
+    def test_rejects_malformed_entries(self):
+        games = self.scraper.parse_entries([
+            # Each entry is matched on its own line
+            'xgid_2015_05_09_atlmlb_wasmlb_1/',
+            'gid_2015_5_09_atlmlb_wasmlb_1/',
+            'gid_2015_05_09_ATLmlb_wasmlb_1/',
+            # Non-ASCII digits don't count as \d
+            'gid_\u0662015_05_09_atlmlb_wasmlb_1/',
+            'gid_2015_05_09_atlmlb_wasmlb_1'])
+        self.assertEqual(games, [])
+
+
+if __name__ == '__main__':
+    unittest.main()